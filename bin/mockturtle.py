@@ -25,7 +25,8 @@ Doing a `mockturtle.py -h` from the command line will show command-line
 usage:
 
     usage: turtle graphics interpreter [-h] [-x WX] [-y WY] [-p TURTLE_PROGRAM]
-                                       [-s {0..25}] [-d DELAY]
+                                       [-s {0..25}] [-d DELAY] [-t FILE] [-c]
+                                       [-m FILE] [--heatmap_scale HEATMAP_SCALE]
      
     optional arguments:
       -h, --help            show this help message and exit
@@ -37,6 +38,14 @@ usage:
                             speed of turtles
       -d DELAY, --delay DELAY
                             delay (ms) between drawing line segments
+      -t FILE, --trace FILE
+                            filename to write a Chrome trace of execution
+      -c, --concurrent      animate turtles simultaneously
+      -m FILE, --heatmap FILE
+                            accumulate lines into a heatmap PNG (and .npy),
+                            with no window
+      --heatmap_scale HEATMAP_SCALE
+                            units per heatmap cell
 
 From within the interpreter, since it subclasses `cmd.Cmd`, you can
 enter `?` to receive help, or `help X` to receive help on a specific
@@ -180,6 +189,15 @@ The main application then starts a thread in which a sublcass of
 then (optionally) reads the commands of any input file, and waits for
 further commands at a prompt.
 
+The canvas can also be zoomed, with the mouse wheel or the `+` and `-`
+keys, or fitted to the extent of the drawing with `f` (or the commands
+`zoom` and `fit`).  The extent is tracked as lines are drawn, and so are
+`DetailLevels`, copies of the drawing in which segments shorter than 1,
+2, 4, ... units are merged.  On zooming, only the part of the drawing
+around the view is redrawn, from the coarsest copy whose merged
+segments would have been under a pixel long, so zooming stays quick
+however much has been drawn.
+
 Both `cmd.Cmd` and `tkinter` run on a loop, and the interaction of these
 has presented some complications.  (Especially in shutting down)  The
 main tk loop runs in the main thread (as is strongly recommended).
@@ -195,8 +213,46 @@ by the 'delay' command-line argument.  (The idea and the form of the
 relevant mathematics here has been taken from the python standard
 library `turtle` module, with some modifications of parameters.)
 
-Turtles themselves do not do their actions concurrently.  And no
-turtle  itself is drawn on the canvas (only the lines appear).
+For very long runs (e.g., random walks of millions of steps), where the
+density of lines matters more than the lines themselves, a heatmap can
+be made instead (`-m FILE`, which needs `numpy`).  No window is opened:
+the shell runs in text mode, and lines are accumulated by a `Heatmap`, a
+grid of cells covering the area the window would show (`-x`, `-y`),
+each `--heatmap_scale` units wide, holding the length of line drawn
+through it.  Segments are rasterized in batches, and the program is read
+a line at a time as it runs, so memory does not grow with the length of
+the program.  On exit, the grid is written as an image to `FILE` and as
+a `numpy` array beside it (`.npy`), and the share of the line drawn
+which fell outside the grid (and so is in neither) is printed.
+
+The segments drawn by turtles are recorded in the shell's
+`SegmentIndex` (`TurtleShell.segments`), a spatial hash kept up to date
+as each `move` is made.  From a script, this can be asked for all the
+points where paths cross (`intersections()`), where one turtle first
+crossed another's path (`first_collision('bill', 'ben')`), and the
+segments within a distance of a point (`near(x, y, d)`).
+
+If a trace file is given (`-t FILE`), a `Tracer` records a span for
+each command, for the parsing of its arguments, for the `Turtle`'s
+arithmetic, and for each line drawn, with its calls to `create_line`,
+`pack` and sleeps.  When the interpreter exits the spans are
+written to the file in Chrome trace-event JSON (which can be loaded
+into chrome://tracing or https://ui.perfetto.dev), and a table of
+the spans taking most time is printed.  In text mode, pass a tracer
+to the shell: `TurtleShell(tracer=Tracer('trace.json'))`.
+
+By default, turtles do not do their actions concurrently: each `move`
+is animated to its end before the next command is run.  In concurrent
+mode (`-c`, or `TurtleShell(concurrent=True)`), each turtle's commands
+are instead added to its own timeline, and a `Scheduler` advances all
+the turtles together, drawing one segment of each per frame, with one
+delay per frame.  The order in which turtles move within a frame is
+fixed, so runs are repeatable, and the time taken is that of the
+longest timeline.  Timelines are run when the commands read so far are
+exhausted, or at a `wait` command; the queries `status`, `within`,
+`nearest` and `find` also run them first, so they report where the
+turtles end up.  No turtle itself is drawn on the
+canvas (only the lines appear).
 
 ## Main classes and functions
 
@@ -211,6 +267,37 @@ turtle  itself is drawn on the canvas (only the lines appear).
     An instance for each turtle created, storing its location,
     orientation, and so on.
 
+  - `class ExecutionControl`:  
+    Lets execution be cancelled, paused and resumed from other threads.
+
+  - `class Scheduler`:  
+    In concurrent mode, advances all turtles' timelines together,
+    frame by frame.
+
+  - `class SegmentIndex`:  
+    Spatial index of the segments drawn, for crossing, collision and
+    proximity queries.
+
+  - `class Heatmap`:  
+    Accumulates the lines drawn into a grid of densities, written out as
+    a PNG image and a `numpy` array.
+
+  - `class CommandQueue`:  
+    The shell's queue of commands, reading a program file lazily.
+
+  - `class TurtleRegistry(dict)`:  
+    The shell's dictionary of turtles, indexed by position (a spatial
+    hash), pen state and colour, for the queries `within`, `nearest`
+    and `find`.
+
+  - `class DetailLevels`:  
+    Copies of the drawing at coarser levels of detail, spatially
+    hashed, for redrawing when zoomed out.
+
+  - `class Tracer`:  
+    Records timed spans of execution in a ring buffer, and writes
+    them out as a Chrome trace.
+
   - `def command_line_args()`:  
     Get command-line arguments using `argparse`
 
@@ -220,11 +307,19 @@ Behaviour when shutting the thing down has involved some compromise.
 (Partly because of `threading`, partly because of issues with the
 interaction of `cmd.Cmd.cmdloop()` and `tk.mainloop()`, I think.)  
 
-If the prompt is waiting for a command, then just write `bye`.
-(Shutting the window, of `CTRL-C`, etc., will not work as they ought;
-though `CTRL-D` does.)  If the application is running a program passed
-from file, then either close the window or `CTRL-C` in the terminal
-should work.
+If the prompt is waiting for a command, then write `bye` (or `CTRL-D`).
+Closing the window or `CTRL-C` in the terminal also work: if a command
+is running, it is interrupted (a line being drawn is abandoned at once,
+rather than when its animation would have finished); if the prompt is
+waiting, the tk loop is stopped and the interpreter's thread ends with
+the program.  Pressing `p` in the window pauses and resumes execution.
+
+In text mode, `CTRL-C` (or `TurtleShell.interrupt()`, from another
+thread) stops the command being run and returns from `cmdloop()`,
+leaving that command at the front of the shell's `cmdqueue`: calling
+`cmdloop()` again resumes from it.  (Between commands, there is
+nothing to stop, and `interrupt()` does nothing.)  `TurtleShell.pause()`
+and `TurtleShell.resume()` hold and release execution.
 
 ## Subset of the turtle language
 
@@ -251,12 +346,35 @@ In addition:
    closes the application
  - `status`  
    prints the current states of all the terminals
+ - `status n`  
+   prints the nth page of the states of the turtles (50 per page)
+ - `within x1 y1 x2 y2`  
+   prints the states of the turtles in the rectangle with corners
+   (x1, y1) and (x2, y2)
+ - `nearest x y`  
+   prints the state of the turtle nearest the point (x, y)
+ - `find pen p colour c`  
+   prints the states of the turtles whose pen is p (`up` or `down`) and
+   whose colour is c (either criterion can be left out)
+ - `wait`  
+   in concurrent mode, waits until all turtles have finished their
+   actions
+
+and, to change the view of the drawing (with a window):
+
+ - `zoom x`  
+   zooms the view of the drawing by a factor x about its centre
+ - `fit`  
+   zooms the view to fit the whole drawing
 
 where:
 
-  - x, for `move`, must be castable to a `float` (so it can be negative
-    or 0)
+  - x, y, x1, y1, x2, y2, for `within` and `nearest`, must be castable
+    to a finite `float` (and are in the coordinates shown by `status`)
+  - x, for `move`, must be castable to a finite `float` (so it can be
+    negative or 0)
   - x, for `left` and `right`, must be castable to a `float` in [0,360)
+  - x, for `zoom`, must be castable to a positive, finite `float`
   - c must be one of `azure`, `beige`, `black`, `blue`, `brown`,
     `chartreuse`, `chocolate`, `coral`, `cyan`,
     `firebrick`, `gainsboro`, `gold`, `gray`,`green`,
@@ -269,14 +387,847 @@ where:
 
 import argparse
 import cmd
+import collections
 from functools import partial
+import heapq
+import inspect
+import itertools
+import json
 import math
 import os.path
 import signal
+import struct
 import sys
 import threading
 import time
 import tkinter as tk
+import zlib
+
+# numpy is needed only for heatmaps
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+########################
+########################
+
+class Tracer:
+    """
+    Recorder of timed spans of execution, for profiling.
+
+    Each span has a name (e.g., 'move', 'create_line', 'sleep'), a
+    category, a start time and a duration.  Spans are kept in a ring
+    buffer whose slots are allocated when the tracer is made, so that
+    recording a span costs a few list assignments; once the buffer is
+    full, the oldest spans are overwritten by the newest.  (Spans are
+    recorded from both the interpreter's thread and tk's, so recording
+    holds a lock.)
+
+    The spans can be written out in Chrome trace-event JSON (viewable
+    in chrome://tracing or https://ui.perfetto.dev), and summarized in
+    a table of the spans on which most time was spent.
+    """
+
+    def __init__(self, filename:str=None, capacity:int=2**18):
+        """
+        Make a tracer.
+
+                filename: file to which the trace will be written
+                capacity: maximum number of spans kept in the buffer
+        """
+
+        self.filename = filename
+        self.capacity = capacity
+        # the ring buffer, as parallel lists, one slot per span
+        self.names = [None] * capacity
+        self.cats = [None] * capacity
+        self.starts = [0] * capacity
+        self.durations = [0] * capacity
+        self.tids = [0] * capacity
+        self.n_spans = 0                # number of spans ever recorded
+        self.lock = threading.Lock()
+        # times are in ns from the perf_counter; the trace starts at origin
+        self.clock = time.perf_counter_ns
+        self.origin = self.clock()
+
+    def record(self, name:str, cat:str, start:int):
+        """
+        Record a span which started at start (from self.clock()) and
+        which ends now.
+        """
+
+        end = self.clock()
+        tid = threading.get_ident()
+        with self.lock:
+            i = self.n_spans % self.capacity
+            self.names[i] = name
+            self.cats[i] = cat
+            self.starts[i] = start
+            self.durations[i] = end - start
+            self.tids[i] = tid
+            self.n_spans += 1
+
+    def spans(self) -> list:
+        """List of (name, cat, start, duration, tid) for kept spans."""
+        spans = []
+        with self.lock:
+            first = max(0, self.n_spans - self.capacity)
+            for n in range(first, self.n_spans):
+                i = n % self.capacity
+                spans.append((self.names[i], self.cats[i], self.starts[i],
+                              self.durations[i], self.tids[i]))
+        return spans
+
+    def write(self, filename:str=None):
+        """Write the kept spans to file as Chrome trace-event JSON."""
+
+        filename = filename or self.filename
+        if not filename:
+            return
+        pid = os.getpid()
+        events = [{'name': name, 'cat': cat, 'ph': 'X', 'pid': pid,
+                   'tid': tid, 'ts': (start - self.origin) / 1000,
+                   'dur': duration / 1000}
+                  for name, cat, start, duration, tid in self.spans()]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self, top:int=10) -> str:
+        """
+        Table of the top spans, by total time spent in them.
+
+        Spans of the same name are aggregated; note that spans nest (a
+        'move' command contains its 'create_line' spans, and so on), so
+        the totals are inclusive.
+        """
+
+        totals = dict()                 # name -> [count, total, max]
+        for name, _, _, duration, _ in self.spans():
+            if name in totals:
+                entry = totals[name]
+                entry[0] += 1
+                entry[1] += duration
+                entry[2] = max(entry[2], duration)
+            else:
+                totals[name] = [1, duration, duration]
+
+        lines = [f'{"span": >14}  {"count": >8}  {"total ms": >10}  '
+                 f'{"mean ms": >9}  {"max ms": >9}']
+        hot = sorted(totals.items(), key=lambda kv: kv[1][1], reverse=True)
+        for name, (count, total, longest) in hot[:top]:
+            lines.append(f'{name: >14}  {count: >8}  {total/1e6: >10.2f}  '
+                         f'{total/count/1e6: >9.3f}  {longest/1e6: >9.3f}')
+        dropped = self.n_spans - self.capacity
+        if dropped > 0:
+            lines.append(f'    ({dropped} earliest spans overwritten)')
+        return '\n'.join(lines)
+
+########################
+########################
+
+class ExecutionInterrupted(Exception):
+    """Raised in the interpreter's thread when execution is cancelled."""
+
+
+class ExecutionControl:
+    """
+    Cooperative cancellation and pausing of the interpreter's execution.
+
+    The interpreter and the animation of lines check in with this object
+    at each command and at each segment drawn (by checkpoint() and
+    sleep()).  Other threads (tk's, a signal handler, a host program) may
+    call cancel(), pause() and resume() at any time: sleeps are waits on
+    a condition variable, so a cancellation takes effect at once, rather
+    than when the current segment's delay has run out.
+    """
+
+    def __init__(self):
+        """Make a control, initially neither cancelled nor paused."""
+        self.condition = threading.Condition()
+        self.cancelled = False
+        self.paused = False
+
+    def cancel(self):
+        """Ask for execution to stop, waking anything asleep or paused."""
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+    def pause(self):
+        """Hold execution at the next checkpoint, until resume()."""
+        with self.condition:
+            self.paused = True
+
+    def resume(self):
+        """Let paused execution continue."""
+        with self.condition:
+            self.paused = False
+            self.condition.notify_all()
+
+    def reset(self):
+        """Clear any cancellation, before execution (re)starts."""
+        with self.condition:
+            self.cancelled = False
+
+    def checkpoint(self):
+        """Wait while paused; raise ExecutionInterrupted if cancelled."""
+        self.sleep(0)
+
+    def sleep(self, seconds:float):
+        """
+        Sleep for the given time, less any time spent paused.
+
+        Raises ExecutionInterrupted as soon as cancel() is called.
+        """
+
+        remaining = seconds
+        with self.condition:
+            while True:
+                if self.cancelled:
+                    raise ExecutionInterrupted
+                if self.paused:
+                    self.condition.wait()
+                    continue
+                if remaining <= 0:
+                    return
+                start = time.monotonic()
+                self.condition.wait(remaining)
+                remaining -= time.monotonic() - start
+
+########################
+########################
+
+def grid_cells(x1:float, y1:float, x2:float, y2:float, size:float):
+    """
+    Generate the cells (i, j) of a square grid, with cells of the given
+    size, through which the segment (x1,y1)--(x2,y2) passes.
+
+    The grid is walked from cell to cell along the segment (as in
+    Amanatides and Woo's voxel traversal), so a long diagonal segment
+    visits a number of cells proportional to its length, rather than to
+    the area of its bounding box.
+    """
+
+    i, j = math.floor(x1/size), math.floor(y1/size)
+    i_end, j_end = math.floor(x2/size), math.floor(y2/size)
+    dx, dy = x2 - x1, y2 - y1
+    step_i = 1 if dx > 0 else -1
+    step_j = 1 if dy > 0 else -1
+    # fraction of the segment at which it next crosses a line of the grid,
+    # and the fraction between successive lines, in x and in y
+    if dx:
+        t_x = ((i + (step_i > 0)) * size - x1) / dx
+        dt_x = size / abs(dx)
+    else:
+        t_x = dt_x = math.inf
+    if dy:
+        t_y = ((j + (step_j > 0)) * size - y1) / dy
+        dt_y = size / abs(dy)
+    else:
+        t_y = dt_y = math.inf
+    yield i, j
+    while (i, j) != (i_end, j_end):
+        if j == j_end or (i != i_end and t_x < t_y):
+            i += step_i
+            t_x += dt_x
+        else:
+            j += step_j
+            t_y += dt_y
+        yield i, j
+
+
+Segment = collections.namedtuple('Segment',
+                                 'x1 y1 x2 y2 turtle seq start end')
+Segment.__doc__ = ('Line segment drawn by a turtle; seq is its order of '
+                   'indexing, and start and end the times its turtle was at '
+                   'either end.')
+
+
+class SegmentIndex:
+    """
+    Index of the line segments drawn by turtles, for spatial queries.
+
+    Segments are added as turtles move (with the pen down), and are kept
+    in a spatial hash: a dict from the cells of a square grid to the
+    segments which pass through them.  Adding a segment touches only the
+    cells it passes through, so the index stays up to date as a program
+    runs.  Queries are:
+
+      - intersections(): all points where segments cross (by a sweep
+        across x)
+      - first_collision(): where one turtle first crosses the path
+        already drawn by another
+      - near(): segments within a distance of a point
+
+    Two successive segments of one turtle always meet where one ends and
+    the next begins; such meetings are not reported as crossings, unless
+    the second segment doubles back along the first.
+    """
+
+    def __init__(self, cell_size:float=50.0):
+        """
+        Make an empty index.
+
+               cell_size: width and height of the cells of the grid
+        """
+
+        self.cell_size = cell_size
+        self.segments = []              # all segments, in order added
+        self.previous = []              # seq -> seq of turtle's last segment
+        self.last = dict()              # turtle name -> seq of last segment
+        self.cells = dict()             # (i, j) -> list of segment seqs
+
+    def __len__(self) -> int:
+        """Number of segments in the index."""
+        return len(self.segments)
+
+    def add(self, turtle:str, x1:float, y1:float, x2:float, y2:float,
+                  start:float=None, end:float=None):
+        """
+        Add the segment (x1,y1)--(x2,y2) drawn by the named turtle.
+
+        start and end are the times at which the turtle was at either end
+        of the segment.  By default both are its seq, as when lines are
+        drawn one after another; in concurrent mode they are frames of
+        the Scheduler, as turtles draw their lines together.
+        """
+
+        seq = len(self.segments)
+        if start is None:
+            start = end = seq
+        self.segments.append(Segment(x1, y1, x2, y2, turtle, seq, start, end))
+        self.previous.append(self.last.get(turtle))
+        self.last[turtle] = seq
+        for cell in grid_cells(x1, y1, x2, y2, self.cell_size):
+            if cell in self.cells:
+                self.cells[cell].append(seq)
+            else:
+                self.cells[cell] = [seq]
+
+    def cells_covering(self, xmin:float, ymin:float, xmax:float, ymax:float):
+        """
+        Generate the grid cells (i, j) which meet the given box.
+
+        If the box covers more cells than are occupied, only the occupied
+        cells in the box are generated.
+        """
+
+        size = self.cell_size
+        imin, imax = math.floor(xmin/size), math.floor(xmax/size)
+        jmin, jmax = math.floor(ymin/size), math.floor(ymax/size)
+        if (imax - imin + 1) * (jmax - jmin + 1) > len(self.cells):
+            for cell in self.cells:
+                if imin <= cell[0] <= imax and jmin <= cell[1] <= jmax:
+                    yield cell
+        else:
+            for i in range(imin, imax + 1):
+                for j in range(jmin, jmax + 1):
+                    yield i, j
+
+    def candidates(self, xmin:float, ymin:float, xmax:float, ymax:float):
+        """Set of seqs of segments which may meet the given box."""
+        found = set()
+        for cell in self.cells_covering(xmin, ymin, xmax, ymax):
+            found.update(self.cells.get(cell, ()))
+        return found
+
+    def joined(self, a:Segment, b:Segment) -> bool:
+        """
+        Whether a and b are successive segments, end to start, of a turtle,
+        which meet only where one ends and the next begins (so not where
+        the second doubles back along the first).
+        """
+
+        if a.seq > b.seq:
+            a, b = b, a
+        if not (self.previous[b.seq] == a.seq
+                and a.x2 == b.x1 and a.y2 == b.y1):
+            return False
+        rx, ry = a.x2 - a.x1, a.y2 - a.y1
+        sx, sy = b.x2 - b.x1, b.y2 - b.y1
+        # b doubles back if it is parallel to a but points the other way
+        doubles_back = abs(rx*sy - ry*sx) <= 1e-9 and rx*sx + ry*sy < 0
+        return not doubles_back
+
+    ############ Queries
+
+    def intersections(self) -> list:
+        """
+        All crossings of segments, as a list of (x, y, a, b), for
+        segments a, b.
+
+        A line is swept across x: segments are taken in order of their
+        left ends, and each is tested only against the 'active' segments,
+        those which the line still meets.  The active segments are kept
+        in bands of y (one per row of the grid), so that each segment is
+        tested only against active segments in the bands it spans.
+        Segments leave the active set when the line passes their right
+        ends (held in a heap).  The sweep allows the same tolerance as
+        intersection(), so that segments which only touch (e.g., at the
+        corners of a square, off by rounding) are still tested.
+        """
+
+        size = self.cell_size
+        # intersection() allows 1e-9 of a segment's length either way, and
+        # no segment is longer than three times the largest coordinate
+        eps = 3e-9 * max([1.0] + [abs(coord) for seg in self.segments
+                                             for coord in seg[:4]])
+        order = sorted(self.segments, key=lambda seg: min(seg.x1, seg.x2))
+        bands = dict()                  # row of grid -> set of active seqs
+        leaving = []                    # heap of (right end, seq, rows)
+        crossings = []
+        for seg in order:
+            left = min(seg.x1, seg.x2)
+            # retire the segments which the sweep line has passed
+            while leaving and leaving[0][0] < left - eps:
+                _, seq, rows = heapq.heappop(leaving)
+                for row in rows:
+                    bands[row].discard(seq)
+            rows = range(math.floor((min(seg.y1, seg.y2) - eps)/size),
+                         math.floor((max(seg.y1, seg.y2) + eps)/size) + 1)
+            # test against active segments in the same bands
+            active = set()
+            for row in rows:
+                active.update(bands.get(row, ()))
+            for seq in sorted(active):
+                other = self.segments[seq]
+                if self.joined(seg, other):
+                    continue
+                point = self.intersection(other, seg)
+                if point:
+                    crossings.append((*point, other, seg))
+            # and make this segment active
+            for row in rows:
+                if row in bands:
+                    bands[row].add(seg.seq)
+                else:
+                    bands[row] = {seg.seq}
+            heapq.heappush(leaving, (max(seg.x1, seg.x2), seg.seq, rows))
+        return crossings
+
+    def first_collision(self, turtle1:str, turtle2:str):
+        """
+        Where either turtle first crossed the path already drawn by the
+        other, as (x, y, a, b), where segment a crossed earlier segment b;
+        or None if their paths never cross.
+
+        Who crossed whom, and which crossing came first, are decided by
+        the times at which the turtles reached the crossing points (see
+        time_at()).
+        """
+
+        first = None                    # ((time, seq, distance), x, y, a, b)
+        for seg in self.segments:
+            if seg.turtle == turtle1:
+                other_turtle = turtle2
+            elif seg.turtle == turtle2:
+                other_turtle = turtle1
+            else:
+                continue
+            candidates = set()
+            for cell in grid_cells(seg.x1, seg.y1, seg.x2, seg.y2,
+                                   self.cell_size):
+                candidates.update(self.cells.get(cell, ()))
+            for seq in candidates:
+                other = self.segments[seq]
+                if other.turtle != other_turtle:
+                    continue
+                point = self.intersection(seg, other)
+                if not point:
+                    continue
+                # seg crossed other if other got to the point first
+                time = self.time_at(seg, *point)
+                if (time, seg.seq) <= (self.time_at(other, *point), other.seq):
+                    continue
+                distance = math.hypot(point[0] - seg.x1, point[1] - seg.y1)
+                key = (time, seg.seq, distance)
+                if first is None or key < first[0]:
+                    first = (key, *point, seg, other)
+        return first[1:] if first else None
+
+    def near(self, x:float, y:float, distance:float) -> list:
+        """All segments within distance of the point (x, y), in order added."""
+        found = []
+        for seq in sorted(self.candidates(x - distance, y - distance,
+                                          x + distance, y + distance)):
+            seg = self.segments[seq]
+            if self.distance_to(seg, x, y) <= distance:
+                found.append(seg)
+        return found
+
+    ############ Geometry
+
+    @staticmethod
+    def intersection(a:Segment, b:Segment):
+        """
+        A point (x, y) at which segments a and b meet, or None.
+
+        If they overlap along a line, the point returned is the start of
+        the overlap nearest the start of a.
+        """
+
+        rx, ry = a.x2 - a.x1, a.y2 - a.y1
+        sx, sy = b.x2 - b.x1, b.y2 - b.y1
+        qx, qy = b.x1 - a.x1, b.y1 - a.y1
+        denominator = rx*sy - ry*sx
+        eps = 1e-9
+        if abs(denominator) > eps:
+            t = (qx*sy - qy*sx) / denominator
+            u = (qx*ry - qy*rx) / denominator
+            if -eps <= t <= 1 + eps and -eps <= u <= 1 + eps:
+                return a.x1 + t*rx, a.y1 + t*ry
+            return None
+        # parallel: they meet only if collinear and overlapping
+        if abs(qx*ry - qy*rx) > eps:
+            return None
+        length2 = rx*rx + ry*ry
+        if length2 == 0:
+            # a is a point
+            if SegmentIndex.distance_to(b, a.x1, a.y1) <= eps:
+                return a.x1, a.y1
+            return None
+        # positions of b's ends along a, as fractions of a's length
+        t0 = (qx*rx + qy*ry) / length2
+        t1 = t0 + (sx*rx + sy*ry) / length2
+        start = max(0.0, min(t0, t1))
+        if start <= min(1.0, max(t0, t1)) + eps:
+            return a.x1 + start*rx, a.y1 + start*ry
+        return None
+
+    @staticmethod
+    def time_at(seg:Segment, x:float, y:float) -> float:
+        """The time at which the segment's turtle was at the point (x, y)."""
+        dx, dy = seg.x2 - seg.x1, seg.y2 - seg.y1
+        length2 = dx*dx + dy*dy
+        if length2 == 0:
+            return seg.start
+        t = max(0.0, min(1.0, ((x - seg.x1)*dx + (y - seg.y1)*dy) / length2))
+        return seg.start + t*(seg.end - seg.start)
+
+    @staticmethod
+    def distance_to(seg:Segment, x:float, y:float) -> float:
+        """Distance from the point (x, y) to the segment."""
+        dx, dy = seg.x2 - seg.x1, seg.y2 - seg.y1
+        length2 = dx*dx + dy*dy
+        if length2 == 0:
+            t = 0.0
+        else:
+            t = max(0.0, min(1.0, ((x - seg.x1)*dx + (y - seg.y1)*dy) / length2))
+        return math.hypot(x - (seg.x1 + t*dx), y - (seg.y1 + t*dy))
+
+########################
+########################
+
+class Heatmap:
+    """
+    Density of the lines drawn by turtles, accumulated on a grid.
+
+    Rather than being drawn, each segment is added to a buffer; when the
+    buffer is full, its segments are clipped to the extent of the grid
+    and rasterized together with numpy: points are sampled along every
+    clipped segment at most half a cell apart, and the length each point
+    stands for is added to the cell it falls in.  The grid thus holds the
+    length of line drawn through each cell, and memory is bounded by the
+    size of the grid and of the buffer, however many and however long
+    the segments drawn.  (The length of line falling outside the extent
+    of the grid is totalled in self.outside.)
+
+    write() saves the grid as a numpy array (.npy) and as a PNG image,
+    on a logarithmic colour scale.
+    """
+
+    def __init__(self, filename:str, extent:tuple, cell_size:float=1.0,
+                       batch_size:int=65536, max_samples:int=1<<20):
+        """
+        Make an empty heatmap.
+
+                filename: PNG file to write (the array goes beside it)
+                  extent: (xmin, ymin, xmax, ymax) covered by the grid
+               cell_size: width and height of each cell of the grid
+              batch_size: number of segments buffered before rasterizing
+             max_samples: most points sampled at once while rasterizing
+        """
+
+        if np is None:
+            raise ImportError('numpy is needed for heatmaps')
+        self.filename = filename
+        self.xmin, self.ymin, self.xmax, self.ymax = extent
+        self.cell_size = cell_size
+        self.batch_size = batch_size
+        self.max_samples = max_samples
+        self.width = max(1, math.ceil((self.xmax - self.xmin) / cell_size))
+        self.height = max(1, math.ceil((self.ymax - self.ymin) / cell_size))
+        # row 0 of the grid is the top (ymax) edge, as in the image
+        self.grid = np.zeros((self.height, self.width))
+        self.outside = 0.0
+        self.pending = []               # x1, y1, x2, y2 of buffered segments
+
+    def add(self, x1:float, y1:float, x2:float, y2:float):
+        """Add the segment (x1,y1)--(x2,y2), rasterizing if buffer is full."""
+        self.pending += (x1, y1, x2, y2)
+        if len(self.pending) >= 4 * self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Rasterize the buffered segments onto the grid."""
+
+        if not self.pending:
+            return
+        segments = np.array(self.pending).reshape(-1, 4)
+        self.pending.clear()
+
+        # ends of the segments, in units of cells from the grid's corner
+        gx1 = (segments[:, 0] - self.xmin) / self.cell_size
+        gy1 = (self.ymax - segments[:, 1]) / self.cell_size
+        gx2 = (segments[:, 2] - self.xmin) / self.cell_size
+        gy2 = (self.ymax - segments[:, 3]) / self.cell_size
+        dx = gx2 - gx1
+        dy = gy2 - gy1
+        lengths = np.hypot(dx, dy) * self.cell_size
+
+        # clip the segments to the grid (Liang-Barsky): the part of each
+        # segment on the grid runs from t0 to t1 along it
+        t0 = np.zeros(len(segments))
+        t1 = np.ones(len(segments))
+        for p, q in ((-dx, gx1), (dx, self.width - gx1),
+                     (-dy, gy1), (dy, self.height - gy1)):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+            # parallel to this edge, and beyond it
+            t1 = np.where((p == 0) & (q < 0), -1.0, t1)
+        on_grid = t1 >= t0
+        self.outside += lengths[~on_grid].sum()
+        self.outside += (lengths[on_grid] * (1 - (t1 - t0)[on_grid])).sum()
+
+        t0, t1 = t0[on_grid], t1[on_grid]
+        gx1, gy1, dx, dy = gx1[on_grid], gy1[on_grid], dx[on_grid], dy[on_grid]
+        gx1, gy1 = gx1 + t0*dx, gy1 + t0*dy
+        dx, dy = (t1 - t0)*dx, (t1 - t0)*dy
+        lengths = (t1 - t0)*lengths[on_grid]
+
+        # samples per segment, at most half a cell apart, each standing
+        # for an equal share of the segment's length; rasterized in runs
+        # of segments with at most max_samples samples between them
+        n_samples = 1 + np.ceil(2 * np.hypot(dx, dy)).astype(np.int64)
+        ends = np.cumsum(n_samples)
+        start = 0
+        while start < len(n_samples):
+            limit = ends[start] - n_samples[start] + self.max_samples
+            stop = max(start + 1, int(np.searchsorted(ends, limit, 'right')))
+            run = slice(start, stop)
+            self.rasterize(gx1[run], gy1[run], dx[run], dy[run],
+                           lengths[run], n_samples[run])
+            start = stop
+
+    def rasterize(self, gx1, gy1, dx, dy, lengths, n_samples):
+        """Add samples along segments (in units of cells) to the grid."""
+
+        owner = np.repeat(np.arange(len(n_samples)), n_samples)
+        firsts = np.cumsum(n_samples) - n_samples
+        k = np.arange(n_samples.sum()) - firsts[owner]
+        t = (k + 0.5) / n_samples[owner]
+        weights = (lengths / n_samples)[owner]
+
+        ix = np.floor(gx1[owner] + t * dx[owner]).astype(np.int64)
+        iy = np.floor(gy1[owner] + t * dy[owner]).astype(np.int64)
+        # (samples can stray off the grid only by rounding at its edges)
+        inside = (ix >= 0) & (ix < self.width) & (iy >= 0) & (iy < self.height)
+        self.outside += weights[~inside].sum()
+        cells = iy[inside] * self.width + ix[inside]
+        self.grid += np.bincount(cells, weights=weights[inside],
+                                 minlength=self.grid.size
+                                 ).reshape(self.grid.shape)
+
+    def write(self, filename:str=None):
+        """Write the grid as a PNG image, and as a .npy array beside it."""
+
+        self.flush()
+        filename = filename or self.filename
+        np.save(os.path.splitext(filename)[0] + '.npy', self.grid)
+
+        # log scale, then black -> red -> yellow -> white
+        peak = self.grid.max()
+        if peak > 0:
+            level = np.log1p(self.grid) / np.log1p(peak)
+        else:
+            level = self.grid
+        stops = [0.0, 1/3, 2/3, 1.0]
+        rgb = np.stack([np.interp(level, stops, [0, 255, 255, 255]),
+                        np.interp(level, stops, [0, 0, 255, 255]),
+                        np.interp(level, stops, [0, 0, 0, 255])], axis=-1)
+        self.write_png(filename, rgb.astype(np.uint8))
+
+    def summary(self) -> str:
+        """How much of the line drawn fell on the grid, and how much off it."""
+        on_grid = self.grid.sum()
+        total = on_grid + self.outside
+        if not total:
+            return 'Heatmap: no lines drawn'
+        return (f'Heatmap: {on_grid:.1f} of {total:.1f} units of line '
+                f'({on_grid/total:.1%}) fell on the grid, and '
+                f'{self.outside/total:.1%} outside it')
+
+    @staticmethod
+    def write_png(filename:str, rgb):
+        """Write an array of shape (height, width, 3) of uint8 as a PNG."""
+
+        height, width, _ = rgb.shape
+        # each row of the image is preceded by its filter type (0: none)
+        rows = np.zeros((height, 1 + 3*width), dtype=np.uint8)
+        rows[:, 1:] = rgb.reshape(height, -1)
+
+        def chunk(kind:bytes, data:bytes) -> bytes:
+            body = kind + data
+            return (struct.pack('>I', len(data)) + body
+                    + struct.pack('>I', zlib.crc32(body)))
+
+        with open(filename, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n')
+            f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                               8, 2, 0, 0, 0)))
+            f.write(chunk(b'IDAT', zlib.compress(rows.tobytes())))
+            f.write(chunk(b'IEND', b''))
+
+########################
+########################
+
+class CommandQueue:
+    """
+    Queue of commands for the shell, read lazily from a program file.
+
+    This stands in for the list which cmd.Cmd uses as its cmdqueue
+    (supporting pop(0), insert(0, line), append(line) and truth
+    testing), but reads the program a line at a time as it is run, so
+    that long programs need not be held in memory, and taking from the
+    front of the queue takes constant time.
+    """
+
+    def __init__(self, filename:str=None):
+        """Make a queue of the lines of the given file (if any)."""
+        self.queued = collections.deque()
+        self.lines = self.read_lines(filename) if filename else iter(())
+
+    @staticmethod
+    def read_lines(filename:str):
+        """Generate the lines of a file, closing it when they are done."""
+        with open(filename) as f:
+            yield from f
+
+    def __bool__(self) -> bool:
+        """Whether any commands remain."""
+        if not self.queued:
+            self.queued.extend(itertools.islice(self.lines, 1))
+        return bool(self.queued)
+
+    def __repr__(self) -> str:
+        return f'CommandQueue({list(self.queued)!r} + unread lines)'
+
+    def pop(self, index:int=0) -> str:
+        """Take the next command from the front of the queue."""
+        if index != 0:
+            raise IndexError('commands can only be taken from the front')
+        if not self:
+            raise IndexError('pop from empty command queue')
+        return self.queued.popleft()
+
+    def insert(self, index:int, line:str):
+        """Put a command at the front of the queue."""
+        if index != 0:
+            raise IndexError('commands can only be inserted at the front')
+        self.queued.appendleft(line)
+
+    def append(self, line:str):
+        """Put a command at the end of the queue (after the whole program)."""
+        self.queued.extend(self.lines)
+        self.queued.append(line)
+
+########################
+########################
+
+class DetailLevels:
+    """
+    The drawing at successively coarser levels of detail, for zooming out.
+
+    Level 0 holds every segment drawn.  Level k (for k > 0) holds the
+    lines simplified so that segments shorter than 2**(k-1) units are
+    merged: a run of joined segments of one colour is followed, and a
+    vertex kept only once it is that far from the last vertex kept.  A
+    level is shown when a pixel is at least as wide as its tolerance,
+    so that the segments merged would have been under a pixel long.
+
+    All the levels are built incrementally, as segments are drawn, and
+    each is kept in a spatial hash whose cells grow with the level, so
+    that showing the view at any zoom touches a bounded number of
+    cells, however much has been drawn.
+
+    Segments are added from the interpreter's thread and read from tk's,
+    so the structures are guarded by a lock (never held during tk calls).
+    """
+
+    def __init__(self, n_levels:int=16):
+        """Make empty levels of detail."""
+        self.tolerances = [0.0] + [2.0**(k - 1) for k in range(1, n_levels)]
+        self.cell_sizes = [128 * max(1.0, t) for t in self.tolerances]
+        self.segments = [[] for _ in range(n_levels)]
+        self.cells = [dict() for _ in range(n_levels)]
+        # per level: (x, y, colour) at the end of a run -> last kept vertex
+        self.runs = [dict() for _ in range(n_levels)]
+        self.lock = threading.Lock()
+
+    def add(self, x1:float, y1:float, x2:float, y2:float, colour:str):
+        """Add a segment drawn, to every level."""
+        with self.lock:
+            self.store(0, (x1, y1, x2, y2, colour))
+            for level in range(1, len(self.tolerances)):
+                runs = self.runs[level]
+                kx, ky = runs.pop((x1, y1, colour), (x1, y1))
+                if math.hypot(x2 - kx, y2 - ky) >= self.tolerances[level]:
+                    self.store(level, (kx, ky, x2, y2, colour))
+                    kx, ky = x2, y2
+                runs[(x2, y2, colour)] = (kx, ky)
+
+    def store(self, level:int, segment:tuple):
+        """Store a segment in a level, and in the cells it passes through."""
+        x1, y1, x2, y2, _ = segment
+        seq = len(self.segments[level])
+        self.segments[level].append(segment)
+        cells = self.cells[level]
+        for cell in grid_cells(x1, y1, x2, y2, self.cell_sizes[level]):
+            if cell in cells:
+                cells[cell].append(seq)
+            else:
+                cells[cell] = [seq]
+
+    def cells_covering(self, level:int, xmin:float, ymin:float,
+                       xmax:float, ymax:float):
+        """Generate the cells (i, j) of a level's grid meeting a box."""
+        size = self.cell_sizes[level]
+        for i in range(math.floor(xmin/size), math.floor(xmax/size) + 1):
+            for j in range(math.floor(ymin/size), math.floor(ymax/size) + 1):
+                yield i, j
+
+    def level_for(self, zoom:float) -> int:
+        """The coarsest level whose tolerance is at most a pixel wide."""
+        pixel = 1 / zoom
+        level = 0
+        while (level + 1 < len(self.tolerances)
+               and self.tolerances[level + 1] <= pixel):
+            level += 1
+        return level
+
+    def visible(self, level:int, xmin:float, ymin:float,
+                xmax:float, ymax:float) -> list:
+        """The segments (x1, y1, x2, y2, colour) of a level meeting a box."""
+        with self.lock:
+            cells = self.cells[level]
+            found = set()
+            for cell in self.cells_covering(level, xmin, ymin, xmax, ymax):
+                found.update(cells.get(cell, ()))
+            segments = self.segments[level]
+            return [segments[seq] for seq in sorted(found)]
 
 ########################
 ########################
@@ -295,12 +1246,26 @@ class TurtleApp(tk.Frame):
 
     Since turtles can wander outside the initial size of the canvas
     (as determined by command-line arguments, by default 600x600),
-    we allow the canvas to be dragged within the frame.
+    we allow the canvas to be dragged within the frame, and zoomed (with
+    the mouse wheel or '+' and '-') or fitted to the extent of the
+    drawing ('f').  Turtle coordinates are mapped to the canvas by the
+    zoom and an offset.  On zooming, the canvas is cleared and redrawn
+    from the matching level of detail (see DetailLevels), only around
+    the part in view; this is redrawn again after each drag.
 
     We spawn a thread for the turtle shell interpreter.  (tkinter's
     interaction with threading module is, according to the internet,
     poor.  This means the main thread must be for the tkinter
     mainloop().)
+
+    If a trace file is given, a Tracer records spans for the drawing of
+    each line and for its create_line, pack and sleep calls.
+
+    In concurrent mode, lines are drawn a segment at a time by the
+    shell's Scheduler, rather than a whole line at a time by draw_line().
+
+    Execution can be paused and resumed by pressing 'p' in the window,
+    and cancelled through the ExecutionControl shared with the shell.
     """
 
     def __init__(self, parent:tk.Widget, args:argparse.Namespace):
@@ -315,21 +1280,55 @@ class TurtleApp(tk.Frame):
         # Register handlers to let us drag the canvas.
         self.canvas.bind("<ButtonPress-1>", self.drag_canvas_prepare)
         self.canvas.bind("<B1-Motion>", self.drag_canvas)
-        
+        # Register handler to pause/resume execution.
+        self.parent.bind("<KeyPress-p>", self.toggle_pause)
+        # Register handlers for zooming.
+        self.canvas.bind("<ButtonRelease-1>", self.drag_canvas_done)
+        self.canvas.bind("<Button-4>", partial(self.zoom_canvas, 1.25))
+        self.canvas.bind("<Button-5>", partial(self.zoom_canvas, 0.8))
+        self.canvas.bind("<MouseWheel>", self.zoom_canvas_wheel)
+        self.parent.bind("<KeyPress-plus>", partial(self.zoom_canvas, 1.25))
+        self.parent.bind("<KeyPress-equal>", partial(self.zoom_canvas, 1.25))
+        self.parent.bind("<KeyPress-minus>", partial(self.zoom_canvas, 0.8))
+        self.parent.bind("<KeyPress-f>", lambda event: self.fit())
+
+        # The view: canvas coordinates are turtle coordinates * zoom + offset.
+        self.zoom = 1.0
+        self.xoffset = 0.0
+        self.yoffset = 0.0
+        self.zoomed = False             # whether the zoom has been changed
+        # The view is changed on tk's thread and read on the shell's, while
+        # lines are drawn; each redraw (of the whole view) is counted.
+        self.view_lock = threading.Lock()
+        self.view_generation = 0
+        # The drawing: its extent (xmin, ymin, xmax, ymax) and levels of detail.
+        self.extent = None
+        self.detail = DetailLevels()
+
         # Values which control the drawing of lines.
         self.speed = args.speed
         self.delay = args.delay / 1000
 
+        # Profiling of execution, if asked for.
+        self.tracer = Tracer(args.trace) if args.trace else None
+        # Cancelling and pausing of execution, shared with the shell.
+        self.control = ExecutionControl()
+
         # Start turtle interpreter thread
         # -- args.wx/2 and args.wy/2 give the coordinates of the centre of
         #    the root window, _before_ any resizing or scrolling has occurred
         # -- orientation of 270 degrees is 'north' for a tk.Canvas
+        # -- the thread is a daemon, so that closing the window while the
+        #    shell is blocked waiting at its prompt still ends the program
         threading.Thread(target=self.run_turtle_shell,
-                         args=(args.wx/2, args.wy/2, 270.0, args.turtle_program)
+                         args=(args.wx/2, args.wy/2, 270.0, args.turtle_program,
+                               args.concurrent),
+                         daemon=True
                         ).start()
 
     
-    def run_turtle_shell(self, x0:float, y0:float, theta:float, turtle_program:str):
+    def run_turtle_shell(self, x0:float, y0:float, theta:float, turtle_program:str,
+                         concurrent:bool=False):
         """
         Start the turtle interpreter shell.
 
@@ -337,9 +1336,11 @@ class TurtleApp(tk.Frame):
                       y0: y-coordinate turtles will start at
                    theta: initial orientation in ° of turtles
           turtle_program: filename of turtle language script to read
+              concurrent: whether turtles are animated simultaneously
         """
 
-        turtleshell = TurtleShell(self, x0, y0, theta, turtle_program)
+        turtleshell = TurtleShell(self, x0, y0, theta, turtle_program,
+                                  self.tracer, self.control, concurrent)
         # store reference to the TurtleShell in the parent (for clean exits)
         self.parent.turtleshell = turtleshell
         turtleshell.cmdloop()
@@ -355,15 +1356,156 @@ class TurtleApp(tk.Frame):
         """Handle event for canvas drag (mouse move while left button down)."""
         self.canvas.scan_dragto(event.x, event.y, gain=1)
 
+    def drag_canvas_done(self, event:tk.Event):
+        """Handle event for end of canvas drag (left button released)."""
+        # once zoomed, only the part of the drawing around the view is drawn
+        if self.zoomed:
+            self.redraw()
+
+    def zoom_canvas(self, factor:float, event:tk.Event):
+        """Handle event for zooming by a factor (wheel on X11, or keys)."""
+        if event.widget is self.canvas:
+            # zoom about the mouse pointer
+            self.zoom_by(factor, event.x, event.y)
+        else:
+            self.zoom_by(factor)
+
+    def zoom_canvas_wheel(self, event:tk.Event):
+        """Handle event for zooming by mouse wheel (other platforms)."""
+        self.zoom_by(1.25 if event.delta > 0 else 0.8, event.x, event.y)
+
+    def toggle_pause(self, event:tk.Event):
+        """Handle event for pausing or resuming execution ('p' pressed)."""
+        if self.control.paused:
+            self.control.resume()
+        else:
+            self.control.pause()
+
     def draw_line(self, xs:float, ys:float, xe:float, ye:float, colour:str):
         """
         Draw line (xs,ys)--(xe-ye) on the canvas.
 
-        We draw the line in segments.  The number of segments is
-        controlled by the speed setting, an integer in [0,25], and
-        set by a modification of a similar formula from the python
-        turtle module.  A pause after each segment results in a
-        simulation of animation.
+        We draw the line in segments (see line_segments()).  A pause
+        after each segment results in a simulation of animation.
+
+        The pause is taken through the ExecutionControl, so that the
+        drawing can be paused, or cancelled (raising ExecutionInterrupted)
+        part-way through the line.
+        """
+
+        tracer = self.tracer
+        if tracer:
+            t_line = tracer.clock()
+
+        for x1, y1, x2, y2 in self.line_segments(xs, ys, xe, ye):
+            self.draw_segment(x1, y1, x2, y2, colour)
+            # Unless we are drawing instantaneously, delay until next segment.
+            if self.speed > 0:
+                if tracer:
+                    t0 = tracer.clock()
+                    self.control.sleep(self.delay)
+                    tracer.record('sleep', 'render', t0)
+                else:
+                    self.control.sleep(self.delay)
+
+        if tracer:
+            tracer.record('draw_line', 'render', t_line)
+
+    def zoom_by(self, factor:float, x:float=None, y:float=None):
+        """
+        Multiply the zoom by a factor, keeping the point (x, y) of the
+        window (by default, its centre) fixed.
+        """
+
+        if x is None:
+            x = self.canvas.winfo_width() / 2
+            y = self.canvas.winfo_height() / 2
+        cx, cy = self.canvas.canvasx(x), self.canvas.canvasy(y)
+        # the turtle coordinates at (x, y), which are to stay there
+        tx = (cx - self.xoffset) / self.zoom
+        ty = (cy - self.yoffset) / self.zoom
+        self.set_view(self.zoom * factor, cx, cy, tx, ty)
+
+    def fit(self):
+        """Zoom and move the view so that the whole drawing is in it."""
+
+        if not self.extent:
+            return
+        xmin, ymin, xmax, ymax = self.extent
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        zoom = 0.9 * min(width / max(xmax - xmin, 1e-6),
+                         height / max(ymax - ymin, 1e-6))
+        # centre of the drawing goes to the centre of the window
+        cx = self.canvas.canvasx(width / 2)
+        cy = self.canvas.canvasy(height / 2)
+        self.set_view(zoom, cx, cy, (xmin + xmax) / 2, (ymin + ymax) / 2)
+
+    def set_view(self, zoom:float, cx:float, cy:float, tx:float, ty:float):
+        """
+        Set the zoom, such that turtle coordinates (tx, ty) are shown at
+        canvas coordinates (cx, cy), and redraw.
+        """
+
+        with self.view_lock:
+            self.zoom = min(max(zoom, 1e-4), 1e4)
+            self.xoffset = cx - tx * self.zoom
+            self.yoffset = cy - ty * self.zoom
+        self.zoomed = True
+        self.redraw()
+
+    def redraw(self):
+        """
+        Redraw the canvas at the current zoom, from the matching level of
+        detail, drawing only segments within a margin of one window
+        around the part in view.
+        """
+
+        tracer = self.tracer
+        if tracer:
+            t0 = tracer.clock()
+
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        cx = self.canvas.canvasx(0)
+        cy = self.canvas.canvasy(0)
+        with self.view_lock:
+            # (segments drawn after this are drawn by draw_segment())
+            self.view_generation += 1
+            zoom, xoffset, yoffset = self.zoom, self.xoffset, self.yoffset
+            level = self.detail.level_for(zoom)
+            segments = self.detail.visible(level,
+                                           (cx - width - xoffset) / zoom,
+                                           (cy - height - yoffset) / zoom,
+                                           (cx + 2*width - xoffset) / zoom,
+                                           (cy + 2*height - yoffset) / zoom)
+        self.canvas.delete('all')
+        # Segments joined end to start, in one colour, are drawn as a single
+        # line through all their points, so that far fewer tk items are made.
+        coords = []
+        run_colour = None
+        run_end = None
+        for x1, y1, x2, y2, colour in segments:
+            if not (coords and colour == run_colour and (x1, y1) == run_end):
+                if coords:
+                    self.canvas.create_line(*coords, fill=run_colour, width=1.6)
+                coords = [x1*zoom + xoffset, y1*zoom + yoffset]
+                run_colour = colour
+            coords += (x2*zoom + xoffset, y2*zoom + yoffset)
+            run_end = (x2, y2)
+        if coords:
+            self.canvas.create_line(*coords, fill=run_colour, width=1.6)
+
+        if tracer:
+            tracer.record('redraw', 'render', t0)
+
+    def line_segments(self, xs:float, ys:float, xe:float, ye:float):
+        """
+        Generate the segments (x1, y1, x2, y2) of line (xs,ys)--(xe,ye).
+
+        The number of segments is controlled by the speed setting, an
+        integer in [0,25], and set by a modification of a similar formula
+        from the python turtle module.
         """
 
         xdelta = xe - xs
@@ -382,29 +1524,87 @@ class TurtleApp(tk.Frame):
 
         x1 = xs
         y1 = ys
-        for _ in range(n_segments):
-            # End-point of next segment.
-            x2 = x1 + dx
-            y2 = y1 + dy
-            # dDraw the line and pack it up.
-            self.canvas.create_line(x1, y1, x2, y2, fill=colour, width=1.6)
-            self.canvas.pack()
+        for i in range(n_segments):
+            # End-point of next segment (the last ending exactly at the end
+            # of the line, so that the next line joins on to it).
+            if i == n_segments - 1:
+                x2, y2 = xe, ye
+            else:
+                x2 = x1 + dx
+                y2 = y1 + dy
+            yield x1, y1, x2, y2
             # Set the beginning of the next segment.
             x1 = x2
             y1 = y2
-            # Unless we are drawing instantaneously, delay until next segment.
-            if self.speed > 0:
-                time.sleep(self.delay)
+
+    def draw_segment(self, x1:float, y1:float, x2:float, y2:float,
+                     colour:str):
+        """
+        Draw one segment of a line on the canvas, and pack it up.
+
+        The segment is also added to the extent of the drawing and to the
+        levels of detail.  If the view is redrawn (on tk's thread) before
+        the line reaches the canvas, the redraw includes the segment, and
+        the line, drawn in the old view, is deleted.
+        """
+
+        with self.view_lock:
+            if self.extent:
+                xmin, ymin, xmax, ymax = self.extent
+                self.extent = (min(xmin, x1, x2), min(ymin, y1, y2),
+                               max(xmax, x1, x2), max(ymax, y1, y2))
+            else:
+                self.extent = (min(x1, x2), min(y1, y2),
+                               max(x1, x2), max(y1, y2))
+            self.detail.add(x1, y1, x2, y2, colour)
+            zoom, xoffset, yoffset = self.zoom, self.xoffset, self.yoffset
+            generation = self.view_generation
+
+        # canvas coordinates, in the view as it was
+        cx1, cy1 = x1*zoom + xoffset, y1*zoom + yoffset
+        cx2, cy2 = x2*zoom + xoffset, y2*zoom + yoffset
+
+        tracer = self.tracer
+        if tracer:
+            t0 = tracer.clock()
+            item = self.canvas.create_line(cx1, cy1, cx2, cy2, fill=colour,
+                                           width=1.6)
+            t1 = tracer.clock()
+            tracer.record('create_line', 'render', t0)
+            self.canvas.pack()
+            tracer.record('canvas.pack', 'render', t1)
+        else:
+            item = self.canvas.create_line(cx1, cy1, cx2, cy2, fill=colour,
+                                           width=1.6)
+            self.canvas.pack()
+        if self.view_generation != generation:
+            self.canvas.delete(item)
 
 ########################
 ########################
 
 class TurtleShell(cmd.Cmd):
-    """Shell object for controlling interpretation of the turtle commands."""
+    """Shell object for controlling interpretation of the turtle commands.
+
+    Execution can be stopped while a command is running by interrupt(),
+    from any thread, or by CTRL-C in text mode.  The command being run
+    is then abandoned (within one segment of any line being drawn), put
+    back at the front of the command queue along with any commands after
+    it, and cmdloop() returns.  Calling cmdloop() again resumes execution from
+    the interrupted command.  pause() and resume() hold and release
+    execution at its next checkpoint.
+
+    In concurrent mode, the commands for each turtle are not run at once,
+    but added to that turtle's timeline, and a Scheduler animates all the
+    turtles together.  The timelines are run when the command queue has
+    been exhausted, or when a 'wait' command is reached.
+    """
     
     def __init__(self, app:TurtleApp=None,
                        x0:float=0.0, y0:float=0.0, theta:float=90.0,
-                       turtle_program:str=None):
+                       turtle_program:str=None, tracer:Tracer=None,
+                       control:ExecutionControl=None, concurrent:bool=False,
+                       heatmap:Heatmap=None):
         """
         Make a command interpreter for the turtle graphics language.
         The defaults are determined by desired behaviour in text mode (when
@@ -415,6 +1615,10 @@ class TurtleShell(cmd.Cmd):
                       y0: y-coordinate turtles will start at
                    theta: initial orientation in ° of turtles
           turtle_program: filename of turtle language script to read
+                  tracer: Tracer recording spans of execution, if any
+                 control: ExecutionControl to share (a new one by default)
+              concurrent: whether turtles are animated simultaneously
+                 heatmap: Heatmap to accumulate lines in, instead of drawing
         """
 
         cmd.Cmd.__init__(self)
@@ -424,20 +1628,32 @@ class TurtleShell(cmd.Cmd):
         self.x0 = x0
         self.y0 = y0
         self.theta = theta
+        self.tracer = tracer
+        self.control = control or ExecutionControl()
+        self.executing = False          # True while a command is running
+        # Lines drawn are either indexed for spatial queries, or (to keep
+        # memory bounded, however many there are) accumulated in a heatmap.
+        self.heatmap = heatmap
+        self.segments = SegmentIndex() if heatmap is None else None
+        # In concurrent mode, the scheduler of the turtles' timelines.
+        if concurrent:
+            self.scheduler = Scheduler(app, self.control, tracer)
+        else:
+            self.scheduler = None
 
         # If the filename of a turtle program was given at the command-line,
-        # then read the lines of the program into the interpreter's command
-        # queue (self.cmdqueue), to be executed when the interpreter starts
-        # its loop.
+        # then the lines of the program become the interpreter's command
+        # queue (self.cmdqueue), to be read and executed when the interpreter
+        # starts its loop.
         if turtle_program:
-            with open(turtle_program) as f:
-                self.cmdqueue = f.readlines()
-            # after reading the program, wait a bit before interpreting it
+            self.cmdqueue = CommandQueue(turtle_program)
+            # after opening the program, wait a bit before interpreting it
             time.sleep(0.25)
         
         self.prompt = ' t: '            # interpreter prompt
 
-        self.turtles = dict()           # dictionary of turtles
+        self.turtles = TurtleRegistry() # dictionary of turtles, indexed
+        self.page_size = 50             # turtles per page of 'status N'
         self.colours =['azure', 'beige', 'black', 'blue', 'brown', 'chartreuse',
                        'chocolate', 'coral', 'cyan', 'firebrick', 'gainsboro',
                        'gold', 'gray', 'green', 'indigo', 'lavender', 'lime',
@@ -457,7 +1673,12 @@ class TurtleShell(cmd.Cmd):
         if not self.turtles:
             return '    No turtles!'
         else:
-            return '\n'.join(f'{k: >14}:  {v}' for k,v in self.turtles.items())
+            return '\n'.join(self.status_lines(self.turtles))
+
+    def status_lines(self, names):
+        """Generate the lines of status of the named turtles."""
+        for name in names:
+            yield f'{name: >14}:  {self.turtles[name]}'
 
     ############ Functions for interpreter commands from turtle language
     ############ (see docs for cmd.Cmd for explanation).
@@ -470,57 +1691,228 @@ class TurtleShell(cmd.Cmd):
         turtle_args = self.parse_args('turtle', args)
         if turtle_args:
             self.turtles[turtle_args[0]] = Turtle(self.app, self.x0, self.y0,
-                                                  self.theta)
+                                                  self.theta, self.tracer,
+                                                  turtle_args[0], self.segments,
+                                                  self.heatmap)
 
     def do_colour(self, args:str):
         'Set the colour of a turtle, e.g.: colour bill red'
         turtle_args = self.parse_args('colour', args)
         if turtle_args:
-            self.turtles[turtle_args[0]].colour = turtle_args[1]
+            self.act(turtle_args[0], 'set_colour', turtle_args[1])
 
     def do_move(self, args:str):
         'Move a turtle a number of units, e.g.: move bill 100'
         turtle_args = self.parse_args('move', args)
         if turtle_args:
-            self.turtles[turtle_args[0]].move(turtle_args[1])
+            self.act(turtle_args[0], 'move', turtle_args[1])
 
     def do_left(self, args:str):
         'Rotate a turtle some degrees anti-clockwise, e.g.: left bill 10'
         turtle_args = self.parse_args('left', args)
         if turtle_args:
-            self.turtles[turtle_args[0]].left(turtle_args[1])
+            self.act(turtle_args[0], 'left', turtle_args[1])
 
     def do_right(self, args:str):
         'Rotate a turtle some degrees clockwise, e.g.: right bill 20'
         turtle_args = self.parse_args('right', args)
         if turtle_args:
-            self.turtles[turtle_args[0]].right(turtle_args[1])
+            self.act(turtle_args[0], 'right', turtle_args[1])
 
     def do_pen(self, args:str):
         'Put the pen up or down, e.g.: pen bill up'
         turtle_args = self.parse_args('pen', args)
         if turtle_args:
-            self.turtles[turtle_args[0]].pen(turtle_args[1])
+            self.act(turtle_args[0], 'pen', turtle_args[1])
+
+    ############ Added command to run the turtles' timelines.
+
+    def do_wait(self, args:str):
+        'Wait for all turtles to finish their actions (in concurrent mode)'
+        if self.scheduler:
+            self.scheduler.run()
 
     ############ Added command to show the current states of the turtles.
 
     def do_status(self, args:str):
-        'Print the current state of the turtles'
-        print(self)
+        'Print the current state of the turtles, or a page of them: status 2'
+        self.do_wait('')
+        if not self.turtles:
+            print(self)
+        elif not args:
+            # print a line at a time, rather than one huge string
+            for line in self.status_lines(self.turtles):
+                print(line)
+        else:
+            status_args = self.parse_args('status', args)
+            if status_args:
+                page = status_args[0]
+                n_pages = -(-len(self.turtles) // self.page_size)
+                start = (page - 1) * self.page_size
+                names = itertools.islice(self.turtles, start,
+                                         start + self.page_size)
+                for line in self.status_lines(names):
+                    print(line)
+                print(f'    (page {page} of {n_pages})')
+
+    ############ Added commands to zoom the view of the drawing.
+
+    def do_zoom(self, args:str):
+        'Zoom the view by a factor about its centre, e.g.: zoom 0.5'
+        zoom_args = self.parse_args('zoom', args)
+        if zoom_args:
+            self.app.zoom_by(zoom_args[0])
+
+    def do_fit(self, args:str):
+        'Zoom the view to fit the whole drawing'
+        if not self.app:
+            print("*** Unknown syntax for 'fit': there is no window")
+        else:
+            self.app.fit()
+
+    ############ Added commands to query the states of the turtles.
+
+    def do_within(self, args:str):
+        'Print the turtles within a rectangle x1 y1 x2 y2, e.g.: within 0 0 100 50'
+        self.do_wait('')
+        query_args = self.parse_args('within', args)
+        if query_args:
+            x1, y1, x2, y2 = query_args
+            names = self.turtles.within(min(x1, x2), min(y1, y2),
+                                        max(x1, x2), max(y1, y2))
+            self.print_found(names)
+
+    def do_nearest(self, args:str):
+        'Print the turtle nearest a point x y, e.g.: nearest 10 20'
+        self.do_wait('')
+        query_args = self.parse_args('nearest', args)
+        if query_args:
+            name = self.turtles.nearest(*query_args)
+            self.print_found([name] if name else [])
+
+    def do_find(self, args:str):
+        'Print the turtles with a pen state and/or colour, e.g.: find pen down colour red'
+        self.do_wait('')
+        query_args = self.parse_args('find', args)
+        if query_args:
+            pen_state = query_args.get('pen')
+            pen_down = None if pen_state is None else pen_state == 'down'
+            names = self.turtles.matching(pen_down, query_args.get('colour'))
+            self.print_found(names)
 
     ############ Commands for exiting the interpreter.
 
     def do_bye(self, args:str):
         'Exit the turtle shell'
+        # in concurrent mode, let the turtles finish first
+        self.do_wait(args)
         return True
 
     def do_EOF(self, args:str):
         'Exit the turtle shell'
         return True
 
+    ############ Controlling execution from other threads.
+
+    def interrupt(self):
+        'Stop execution, keeping the current command queued to resume'
+        # (between commands there is nothing to stop)
+        if self.executing:
+            self.control.cancel()
+
+    def pause(self):
+        'Hold execution at its next checkpoint'
+        self.control.pause()
+
+    def resume(self):
+        'Continue paused execution'
+        self.control.resume()
+
+    ############ Execution and profiling hooks (see docs for cmd.Cmd).
+
+    def preloop(self):
+        """Clear any earlier interruption, so that execution can resume."""
+        self.control.reset()
+
+    def onecmd(self, line:str):
+        """
+        Interpret one command, recording a span for it if tracing.
+
+        If execution is cancelled (or CTRL-C is pressed), the command is
+        put back at the front of the queue and the loop is stopped.
+        """
+
+        self.executing = True
+        try:
+            self.control.checkpoint()
+            if not self.tracer:
+                return cmd.Cmd.onecmd(self, line)
+            t0 = self.tracer.clock()
+            stop = cmd.Cmd.onecmd(self, line)
+            words = line.split(maxsplit=1)
+            self.tracer.record(words[0] if words else 'emptyline',
+                               'command', t0)
+            return stop
+        except (ExecutionInterrupted, KeyboardInterrupt):
+            self.cmdqueue.insert(0, line)
+            # the cancellation is spent, so the next command can run
+            self.control.reset()
+            print(f'*** Interrupted: {line.strip()}')
+            return True
+        finally:
+            self.executing = False
+
+    def postcmd(self, stop:bool, line:str) -> bool:
+        """
+        In concurrent mode, once the command queue is exhausted, queue a
+        'wait', so that the turtles' timelines are run before the prompt.
+        (Being a command, an interrupted 'wait' is resumed like any other.)
+        """
+
+        if (self.scheduler and not stop and not self.cmdqueue
+            and self.scheduler.pending()):
+            self.cmdqueue.append('wait')
+        return stop
+
+    def postloop(self):
+        """
+        Write out the heatmap, if any, reporting how much line fell off its
+        grid, and the trace, if any, summarizing its hot spots.
+        """
+        if self.heatmap:
+            self.heatmap.write()
+            print(self.heatmap.summary())
+        if self.tracer:
+            self.tracer.write()
+            print(self.tracer.summary())
+
     ############
     ############ Helpers
 
+    def print_found(self, names:list):
+        """Print the status of the turtles found by a query."""
+        if not names:
+            print('    No turtles found')
+        for line in self.status_lines(names):
+            print(line)
+
+    def act(self, name:str, action:str, arg):
+        """
+        Have the named turtle do an action (the name of one of its methods).
+
+        In concurrent mode, the action is added to the turtle's timeline;
+        a move is then animated by Turtle.move_frames().
+        """
+
+        turtle = self.turtles[name]
+        if not self.scheduler:
+            getattr(turtle, action)(arg)
+        elif action == 'move':
+            self.scheduler.add(name, partial(turtle.move_frames, arg,
+                                             self.scheduler.clock))
+        else:
+            self.scheduler.add(name, partial(getattr(turtle, action), arg))
+
     def parse_args(self, command:str, args:str):
         """Parse arguments to the turtle language commands.
 
@@ -531,6 +1923,16 @@ class TurtleShell(cmd.Cmd):
         commands, and seems proper.)
         """
 
+        if not self.tracer:
+            return self._parse_args(command, args)
+        t0 = self.tracer.clock()
+        turtle_args = self._parse_args(command, args)
+        self.tracer.record('parse', 'command', t0)
+        return turtle_args
+
+    def _parse_args(self, command:str, args:str):
+        """Parse arguments, as for parse_args(), without tracing."""
+
         # no arguments supplied (there always ought to be at least one)
         if not args:
             print(f"*** Unknown syntax for '{command}': arguments needed")
@@ -581,6 +1983,10 @@ class TurtleShell(cmd.Cmd):
                     print(f"*** Unknown syntax for '{command}': "
                           f"'{turtle_arg_list[1]}'' is not a real number")
                     return
+                if not math.isfinite(delta):
+                    print(f"*** Unknown syntax for '{command}': "
+                          f"'{turtle_arg_list[1]}'' should be finite")
+                    return
                 turtle_arg_list[1] = delta
                 return turtle_arg_list
         ### arguments for 'rotate' (i.e., 'left' and 'right')
@@ -600,7 +2006,7 @@ class TurtleShell(cmd.Cmd):
                     print(f"*** Unknown syntax for '{command}': "
                           f"'{turtle_arg_list[1]}'' is not a real number")
                     return
-                if theta < 0.0 or theta >= 360.0:
+                if not 0.0 <= theta < 360.0:
                     print(f"*** Unknown syntax for '{command}': "
                           f"'{turtle_arg_list[1]}'' should be in [0,360)")
                     return
@@ -623,6 +2029,83 @@ class TurtleShell(cmd.Cmd):
                 return
             else:
                 return turtle_arg_list
+        ### arguments for 'status'
+        elif command == 'status':
+            if n_args != 1:
+                print(f"*** Unknown syntax for '{command}' (wrong #args): "
+                      f"{args}")
+                return
+            n_pages = -(-len(self.turtles) // self.page_size)
+            try:
+                page = int(turtle_arg_list[0])
+            except ValueError:
+                print(f"*** Unknown syntax for '{command}': "
+                      f"'{turtle_arg_list[0]}'' is not a whole number")
+                return
+            if page < 1 or page > n_pages:
+                print(f"*** Unknown syntax for '{command}': "
+                      f"'{turtle_arg_list[0]}'' should be in [1,{n_pages}]")
+                return
+            return [page]
+        ### arguments for 'zoom'
+        elif command == 'zoom':
+            if n_args != 1:
+                print(f"*** Unknown syntax for '{command}' (wrong #args): "
+                      f"{args}")
+                return
+            elif not self.app:
+                print(f"*** Unknown syntax for '{command}': there is no window")
+                return
+            try:
+                factor = float(turtle_arg_list[0])
+            except ValueError:
+                print(f"*** Unknown syntax for '{command}': "
+                      f"'{turtle_arg_list[0]}'' is not a real number")
+                return
+            if not (math.isfinite(factor) and factor > 0.0):
+                print(f"*** Unknown syntax for '{command}': "
+                      f"'{turtle_arg_list[0]}'' should be positive and finite")
+                return
+            return [factor]
+        ### arguments for 'within' and 'nearest' (i.e., coordinates)
+        elif command == 'within' or command == 'nearest':
+            n_coords = 4 if command == 'within' else 2
+            if n_args != n_coords:
+                print(f"*** Unknown syntax for '{command}' (wrong #args): "
+                      f"{args}")
+                return
+            try:
+                coords = [float(arg) for arg in turtle_arg_list]
+            except ValueError:
+                print(f"*** Unknown syntax for '{command}': "
+                      f"'{args}'' are not all real numbers")
+                return
+            if not all(map(math.isfinite, coords)):
+                print(f"*** Unknown syntax for '{command}': "
+                      f"'{args}'' are not all finite")
+                return
+            return coords
+        ### arguments for 'find' (pairs of 'pen' state and/or 'colour' c)
+        elif command == 'find':
+            if n_args not in (2, 4):
+                print(f"*** Unknown syntax for '{command}' (wrong #args): "
+                      f"{args}")
+                return
+            criteria = dict(zip(turtle_arg_list[0::2], turtle_arg_list[1::2]))
+            if len(criteria) != n_args // 2 or not set(criteria) <= {'pen', 'colour'}:
+                print(f"*** Unknown syntax for '{command}': "
+                      f"'{args}'' should be 'pen' and/or 'colour' criteria")
+                return
+            elif criteria.get('pen', 'up') not in self.pen_states:
+                print(f"*** Unknown syntax for '{command}': "
+                      f"'{criteria['pen']}'' is not a known pen state")
+                return
+            elif criteria.get('colour', 'black') not in self.colours:
+                print(f"*** Unknown syntax for '{command}': "
+                      f"'{criteria['colour']}'' is not a known colour")
+                return
+            else:
+                return criteria
 
 ########################
 ########################
@@ -631,7 +2114,9 @@ class Turtle:
     """Class for storing current state of each turtle."""
 
     def __init__(self, app:TurtleApp=None,
-                       x:float=0.0, y:float=0.0, theta:float=90.0):
+                       x:float=0.0, y:float=0.0, theta:float=90.0,
+                       tracer:Tracer=None, name:str=None,
+                       segments:SegmentIndex=None, heatmap:Heatmap=None):
         """
         Make a turtle.
 
@@ -654,6 +2139,11 @@ class Turtle:
         self.theta = theta
         self.pen_down = True
         self.colour = 'black'
+        self.tracer = tracer            # Tracer for profiling, if any
+        self.name = name                # name in the shell, if any
+        self.registry = None            # TurtleRegistry holding it, if any
+        self.segments = segments        # SegmentIndex of lines drawn, if any
+        self.heatmap = heatmap          # Heatmap to draw on instead, if any
 
 
     def __str__(self) -> str:
@@ -690,15 +2180,28 @@ class Turtle:
             self.theta = (self.theta + dtheta) % 360
 
 
+    def destination(self, delta:float) -> tuple:
+        """Coordinates delta units away in the turtle's current direction."""
+        if self.tracer:
+            t0 = self.tracer.clock()
+        theta_radians = math.radians(self.theta)
+        x2 = self.x + (delta * math.cos(theta_radians))
+        y2 = self.y + (delta * math.sin(theta_radians))
+        if self.tracer:
+            self.tracer.record('Turtle.move', 'turtle', t0)
+        return x2, y2
+
+
     def move(self, delta:float):
         """Move the turtle delta units in its current direction."""
 
         # calculate coords to move to
-        theta_radians = math.radians(self.theta)
-        x2 = self.x + (delta * math.cos(theta_radians))
-        y2 = self.y + (delta * math.sin(theta_radians))
+        x2, y2 = self.destination(delta)
 
-        if self.pen_down:
+        if self.pen_down and self.heatmap:
+            # lines are accumulated, not drawn
+            self.heatmap.add(self.x, self.y, x2, y2)
+        elif self.pen_down:
             if self.app:
                 # if we have a gui, drawing is controlled by it
                 self.app.draw_line(self.x, self.y, x2, y2, self.colour)
@@ -706,10 +2209,52 @@ class Turtle:
                 # in text mode, we notify the line drawn to stdout
                 print(f'    drew from ({self.x:.2f}, {self.y:.2f})'
                       f' to ({x2:.2f}, {y2:.2f})')
+            if self.segments is not None:
+                self.segments.add(self.name, self.x, self.y, x2, y2)
         
         # update turtle position
         self.x = x2
         self.y = y2
+        if self.registry:
+            self.registry.reindex(self)
+
+
+    def move_frames(self, delta:float, clock=None):
+        """
+        Move the turtle as for move(), yielding after each segment drawn.
+
+        This is for the Scheduler, which interleaves the segments of
+        different turtles and takes the delays between them.  (With the
+        pen up, no segments are drawn and the move takes no frames.)
+        clock, if given, is called for the current frame, so that the
+        line indexed records when it was drawn.
+        """
+
+        x2, y2 = self.destination(delta)
+        start = clock() if clock else None
+
+        if self.pen_down and self.heatmap:
+            self.heatmap.add(self.x, self.y, x2, y2)
+            yield
+        elif self.pen_down:
+            if self.app:
+                for segment in self.app.line_segments(self.x, self.y, x2, y2):
+                    self.app.draw_segment(*segment, self.colour)
+                    yield
+            else:
+                print(f'    drew from ({self.x:.2f}, {self.y:.2f})'
+                      f' to ({x2:.2f}, {y2:.2f})')
+                yield
+            if self.segments is not None:
+                end = clock() if clock else None
+                self.segments.add(self.name, self.x, self.y, x2, y2,
+                                  start, end)
+
+        # update turtle position
+        self.x = x2
+        self.y = y2
+        if self.registry:
+            self.registry.reindex(self)
 
 
     def pen(self, pen_position:str):
@@ -718,6 +2263,8 @@ class Turtle:
             self.pen_down = False
         elif pen_position == 'down':
             self.pen_down = True
+        if self.registry:
+            self.registry.reindex(self)
 
 
     def right(self, dtheta:float):
@@ -728,6 +2275,328 @@ class Turtle:
             # text mode
             self.theta = (self.theta - dtheta) % 360
 
+
+    def set_colour(self, colour:str):
+        """Set the colour in which the turtle draws."""
+        self.colour = colour
+        if self.registry:
+            self.registry.reindex(self)
+
+########################
+########################
+
+class Scheduler:
+    """
+    Animation of turtles simultaneously, each with its own timeline.
+
+    A timeline is a queue of actions for one turtle: calls to its
+    methods, or generators (from Turtle.move_frames()) which draw a
+    segment each time they are advanced.  Frame by frame, the scheduler
+    advances each turtle with a pending timeline by one segment, in the
+    order in which the timelines were started, and then delays once for
+    all of them.  Actions which draw nothing (turning, changing pen or
+    colour) take no frame of their own.
+
+    Interleaving is thus deterministic, and the time taken is that of the
+    longest timeline, not the sum of all of them.
+    """
+
+    def __init__(self, app:TurtleApp=None, control:ExecutionControl=None,
+                       tracer:Tracer=None):
+        """
+        Make a scheduler.
+
+                     app: TurtleApp on which turtles draw, if any
+                 control: ExecutionControl for delays between frames
+                  tracer: Tracer recording spans of execution, if any
+        """
+
+        self.app = app
+        self.control = control or ExecutionControl()
+        self.tracer = tracer
+        self.timelines = dict()         # turtle name -> deque of actions
+        self.current = dict()           # turtle name -> move being animated
+        self.frame = 0                  # number of frames run so far
+
+    def add(self, name:str, action):
+        """Add an action (a callable) to the end of a turtle's timeline."""
+        if name in self.timelines:
+            self.timelines[name].append(action)
+        else:
+            self.timelines[name] = collections.deque([action])
+
+    def pending(self) -> bool:
+        """Whether any timeline has actions left to run."""
+        return bool(self.timelines)
+
+    def clock(self) -> int:
+        """The current frame (counting all the frames ever run)."""
+        return self.frame
+
+    def run(self):
+        """
+        Run all the timelines, frame by frame, until they are finished.
+
+        If execution is cancelled, ExecutionInterrupted is raised between
+        frames (or during a delay), and the timelines are left as they
+        were, so that a further run() continues from the same frame.
+        """
+
+        tracer = self.tracer
+        app = self.app
+        while self.timelines:
+            self.control.checkpoint()
+            if tracer:
+                t_frame = tracer.clock()
+            drawn = False
+            for name in list(self.timelines):
+                if self.step(name):
+                    drawn = True
+                else:
+                    del self.timelines[name]
+            self.frame += 1
+            if tracer:
+                tracer.record('frame', 'render', t_frame)
+            # Unless we are drawing instantaneously, delay until next frame.
+            if drawn and app and app.speed > 0:
+                if tracer:
+                    t0 = tracer.clock()
+                    self.control.sleep(app.delay)
+                    tracer.record('sleep', 'render', t0)
+                else:
+                    self.control.sleep(app.delay)
+
+    def step(self, name:str) -> bool:
+        """
+        Advance a turtle's timeline by one segment drawn.
+
+        Returns False if the timeline finished without drawing anything.
+        """
+
+        actions = self.timelines[name]
+        while True:
+            if name in self.current:
+                try:
+                    next(self.current[name])
+                    return True
+                except StopIteration:
+                    del self.current[name]
+            if not actions:
+                return False
+            result = actions.popleft()()
+            if inspect.isgenerator(result):
+                self.current[name] = result
+
+########################
+########################
+
+class TurtleRegistry(dict):
+    """
+    Dictionary of turtles by name, indexed for queries on their states.
+
+    Besides the turtles themselves, we keep
+      - a spatial hash: a dict from the cells of a square grid to the
+        names of the turtles in them
+      - secondary indexes, from pen state and from colour, to names
+    so that we can quickly find the turtles in a rectangle (within()),
+    the turtle nearest a point (nearest()), and the turtles with a given
+    pen state and/or colour (matching()).
+
+    A turtle added to the registry is given a reference to it, and
+    calls reindex() whenever it moves or changes its pen or colour
+    (which must be done through its methods), so that the indexes stay
+    up to date.  (The dict's methods which add or remove turtles are
+    overridden to keep the indexes, too.)
+    """
+
+    def __init__(self, cell_size:float=50.0):
+        """
+        Make an empty registry.
+
+               cell_size: width and height of the cells of the grid
+        """
+
+        dict.__init__(self)
+        self.cell_size = cell_size
+        self.cells = dict()             # (i, j) -> set of names
+        self.by_pen = {True: set(), False: set()}
+        self.by_colour = dict()         # colour -> set of names
+        self.index_keys = dict()        # name -> (cell, pen_down, colour)
+
+    def __setitem__(self, name:str, turtle:Turtle):
+        """Add a turtle (replacing any other of the same name)."""
+        if name in self:
+            # (keeping the name's place in the order of the turtles)
+            self.unindex(name)
+            dict.__getitem__(self, name).registry = None
+        dict.__setitem__(self, name, turtle)
+        turtle.name = name
+        turtle.registry = self
+        self.index(name, turtle)
+
+    def __delitem__(self, name:str):
+        """Remove a turtle, and its entries in the indexes."""
+        self.unindex(name)
+        dict.__getitem__(self, name).registry = None
+        dict.__delitem__(self, name)
+
+    def pop(self, name:str, *default):
+        """Remove a turtle and return it (or default, if given, if none)."""
+        if name not in self:
+            return dict.pop(self, name, *default)
+        turtle = dict.__getitem__(self, name)
+        del self[name]
+        return turtle
+
+    def popitem(self) -> tuple:
+        """Remove the turtle added last, returning (name, turtle)."""
+        if not self:
+            raise KeyError('popitem(): registry is empty')
+        name = next(reversed(self))
+        return name, self.pop(name)
+
+    def clear(self):
+        """Remove all the turtles, and empty the indexes."""
+        for turtle in self.values():
+            turtle.registry = None
+        dict.clear(self)
+        self.cells.clear()
+        self.by_pen = {True: set(), False: set()}
+        self.by_colour.clear()
+        self.index_keys.clear()
+
+    def setdefault(self, name:str, turtle:Turtle) -> Turtle:
+        """The turtle of the given name, adding turtle if there is none."""
+        if name not in self:
+            self[name] = turtle
+        return dict.__getitem__(self, name)
+
+    def update(self, *args, **kwargs):
+        """Add turtles from a mapping or (name, turtle) pairs, as for a dict."""
+        for name, turtle in dict(*args, **kwargs).items():
+            self[name] = turtle
+
+    def __ior__(self, other):
+        """Add turtles from a mapping or (name, turtle) pairs (for |=)."""
+        self.update(other)
+        return self
+
+    def cell(self, x:float, y:float) -> tuple:
+        """The cell (i, j) of the grid containing the point (x, y)."""
+        return (math.floor(x/self.cell_size), math.floor(y/self.cell_size))
+
+    def index(self, name:str, turtle:Turtle):
+        """Add entries for a turtle to the indexes."""
+        key = (self.cell(turtle.x, turtle.y), turtle.pen_down, turtle.colour)
+        self.index_keys[name] = key
+        cell, pen_down, colour = key
+        if cell in self.cells:
+            self.cells[cell].add(name)
+        else:
+            self.cells[cell] = {name}
+        self.by_pen[pen_down].add(name)
+        if colour in self.by_colour:
+            self.by_colour[colour].add(name)
+        else:
+            self.by_colour[colour] = {name}
+
+    def unindex(self, name:str):
+        """Remove the entries for a turtle from the indexes."""
+        cell, pen_down, colour = self.index_keys.pop(name)
+        self.cells[cell].discard(name)
+        if not self.cells[cell]:
+            del self.cells[cell]
+        self.by_pen[pen_down].discard(name)
+        self.by_colour[colour].discard(name)
+        if not self.by_colour[colour]:
+            del self.by_colour[colour]
+
+    def reindex(self, turtle:Turtle):
+        """Bring the indexes up to date with a turtle's state."""
+        name = turtle.name
+        if self.get(name) is not turtle:
+            # a turtle since replaced, e.g. finishing a concurrent timeline
+            return
+        key = (self.cell(turtle.x, turtle.y), turtle.pen_down, turtle.colour)
+        if key != self.index_keys[name]:
+            self.unindex(name)
+            self.index(name, turtle)
+
+    ############ Queries
+
+    def within(self, xmin:float, ymin:float, xmax:float, ymax:float) -> list:
+        """Names of the turtles in the given rectangle, sorted."""
+        (imin, jmin), (imax, jmax) = self.cell(xmin, ymin), self.cell(xmax, ymax)
+        found = []
+        if (imax - imin + 1) * (jmax - jmin + 1) > len(self.cells):
+            # the rectangle covers more cells than are occupied
+            cells = [cell for cell in self.cells
+                     if imin <= cell[0] <= imax and jmin <= cell[1] <= jmax]
+        else:
+            cells = [(i, j) for i in range(imin, imax + 1)
+                            for j in range(jmin, jmax + 1)]
+        for cell in cells:
+            for name in self.cells.get(cell, ()):
+                turtle = self[name]
+                if xmin <= turtle.x <= xmax and ymin <= turtle.y <= ymax:
+                    found.append(name)
+        return sorted(found)
+
+    def nearest(self, x:float, y:float):
+        """
+        Name of the turtle nearest the point (x, y) (None if there are
+        no turtles).
+
+        We search rings of cells outward from the cell containing the
+        point, stopping once no nearer turtle can lie further out; if the
+        rings grow larger than the number of occupied cells, we check
+        the turtles of all occupied cells instead.
+        """
+
+        best, best_distance = None, math.inf
+        i0, j0 = self.cell(x, y)
+        r = 0
+        while self.cells:
+            # every cell of ring r is at least (r-1) cells away
+            if best_distance <= (r - 1) * self.cell_size:
+                break
+            if 8 * r > len(self.cells):
+                cells = self.cells
+            elif r == 0:
+                cells = [(i0, j0)]
+            else:
+                cells = ([(i0 + di, j0 + dj) for di in range(-r, r + 1)
+                                             for dj in (-r, r)]
+                         + [(i0 + di, j0 + dj) for di in (-r, r)
+                                               for dj in range(-r + 1, r)])
+            for cell in cells:
+                for name in self.cells.get(cell, ()):
+                    turtle = self[name]
+                    distance = math.hypot(turtle.x - x, turtle.y - y)
+                    if (distance, name) < (best_distance, best or ''):
+                        best, best_distance = name, distance
+            if cells is self.cells:
+                break
+            r += 1
+        return best
+
+    def matching(self, pen_down:bool=None, colour:str=None) -> list:
+        """Names of the turtles with the given pen state and colour, sorted.
+
+        Either may be None, to match any.
+        """
+
+        indexes = []
+        if pen_down is not None:
+            indexes.append(self.by_pen[pen_down])
+        if colour is not None:
+            indexes.append(self.by_colour.get(colour, set()))
+        if not indexes:
+            return sorted(self)
+        # start from the smallest index, keeping what is in the others
+        indexes.sort(key=len)
+        return sorted(indexes[0].intersection(*indexes[1:]))
+
 ########################
 ######################## setup functions, if running as script
 
@@ -756,6 +2625,20 @@ def command_line_args():
                         type=int,
                         default=50,
                         help='delay (ms) between drawing line segments')
+    parser.add_argument('-t', '--trace',
+                        metavar='FILE',
+                        help='filename to write a Chrome trace of execution')
+    parser.add_argument('-c', '--concurrent',
+                        action='store_true',
+                        help='animate turtles simultaneously')
+    parser.add_argument('-m', '--heatmap',
+                        metavar='FILE',
+                        help='accumulate lines into a heatmap PNG (and .npy), '
+                             'with no window')
+    parser.add_argument('--heatmap_scale',
+                        type=float,
+                        default=1.0,
+                        help='units per heatmap cell')
     args = parser.parse_args()
 
     # Run some checks
@@ -763,6 +2646,13 @@ def command_line_args():
         if not os.path.isfile(args.turtle_program):
             print(f'Error: turtle program file {args.turtle_program} not found')
             sys.exit(1)
+    if args.heatmap:
+        if np is None:
+            print('Error: numpy is needed for --heatmap')
+            sys.exit(1)
+        if not (math.isfinite(args.heatmap_scale) and args.heatmap_scale > 0):
+            print('Error: --heatmap_scale must be positive and finite')
+            sys.exit(1)
 
     return args
 
@@ -774,6 +2664,12 @@ def configure_root(root:tk.Tk, width:int, height:int):
     # register SIGTERM/SIGINT handler
     signal.signal(signal.SIGTERM, partial(bye_to_turtleshell, root))
     signal.signal(signal.SIGINT, partial(bye_to_turtleshell, root))
+    # Python runs signal handlers only between tk events, and tk's
+    # mainloop may otherwise wait indefinitely for one; so we keep a
+    # steady tick of events, for CTRL-C to be handled promptly
+    def tick():
+        root.after(50, tick)
+    root.after(50, tick)
     """Set some basic properties of the root window."""
     root.geometry(f'{width}x{height}+750+50')
     root.title('Turtles')
@@ -784,21 +2680,40 @@ def configure_root(root:tk.Tk, width:int, height:int):
 def bye_to_turtleshell(root:tk.Tk, *args):
     """Handler if root window is closed, or SIGTERM/SIGINT received.
 
-    We tell the interpreter to exit by putting 'bye' at the front of its
-    command queue.  This stops the interpreter.  Code in
-    TurtleApp.run_turtle_shell() then destroys all the tk objects.
-
-    However, it will only do this the next time the cmd.Cmd's cmdloop()
-    draws a line from its cmdqueue; so if the interpreter is waiting
-    for something from the prompt, this has no effect (until the cmdloop()'s
-    readline() exits).
+    If the interpreter is running a command, we interrupt it: any line
+    being drawn is abandoned at once, and the cmd.Cmd's cmdloop() exits.
+    Code in TurtleApp.run_turtle_shell() then destroys all the tk objects.
 
-    As a consequence, the correct way to stop everything, if the prompt is
-    waiting for a command, is by writing 'bye' at the prompt.
+    If the interpreter is instead waiting for something from the prompt,
+    its readline() cannot be woken; so we do the shell's cleanup (e.g.,
+    writing any trace) ourselves, then stop the tk mainloop directly, and
+    the interpreter's (daemon) thread dies with the program.
     """
     
-    if root.turtleshell:
-        root.turtleshell.cmdqueue.insert(0, 'bye')
+    turtleshell = getattr(root, 'turtleshell', None)
+    if turtleshell and turtleshell.executing:
+        turtleshell.interrupt()
+    else:
+        if turtleshell:
+            turtleshell.postloop()
+        root.quit()
+
+########################
+########################
+
+def run_heatmap(args:argparse.Namespace):
+    """
+    Run the turtle shell in text mode, accumulating lines into a heatmap.
+
+    The heatmap covers the area the window would show (turtles start at
+    its centre), and is written when the shell exits.
+    """
+
+    extent = (-args.wx/2, -args.wy/2, args.wx/2, args.wy/2)
+    heatmap = Heatmap(args.heatmap, extent, args.heatmap_scale)
+    tracer = Tracer(args.trace) if args.trace else None
+    TurtleShell(turtle_program=args.turtle_program, tracer=tracer,
+                concurrent=args.concurrent, heatmap=heatmap).cmdloop()
 
 ########################
 ########################
@@ -806,6 +2721,9 @@ def bye_to_turtleshell(root:tk.Tk, *args):
 def main():
 
     args = command_line_args()                 # get command-line args and check
+    if args.heatmap:
+        run_heatmap(args)                      # no window: just the heatmap
+        return
     root = tk.Tk()                             # make the root tk window
     configure_root(root, args.wx, args.wy)     # set root window properties
     TurtleApp(root, args)                      # start turtle app in the root 
@@ -0,0 +1,49 @@
+"""Regression checks of SegmentIndex.intersections() against brute force."""
+
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bin'))
+
+from mockturtle import TurtleShell
+
+
+def segments_drawn(program:str):
+    """The SegmentIndex of the lines drawn by a bundled turtle program."""
+    shell = TurtleShell(turtle_program=os.path.join(ROOT, 'turtle_programs',
+                                                    program))
+    with contextlib.redirect_stdout(io.StringIO()):
+        while shell.cmdqueue:
+            shell.onecmd(shell.cmdqueue.pop(0))
+    return shell.segments
+
+
+class TestIntersections(unittest.TestCase):
+
+    def check_against_brute_force(self, program:str):
+        """The sweep finds just the pairs that pairwise tests do."""
+        index = segments_drawn(program)
+        segments = index.segments
+        expected = set()
+        for i, a in enumerate(segments):
+            for b in segments[i+1:]:
+                if not index.joined(a, b) and index.intersection(a, b):
+                    expected.add((a.seq, b.seq))
+        found = {tuple(sorted((a.seq, b.seq)))
+                 for _, _, a, b in index.intersections()}
+        self.assertTrue(expected)
+        self.assertEqual(found, expected)
+
+    def test_redsquare(self):
+        self.check_against_brute_force('redsquare.tt')
+
+    def test_squares(self):
+        self.check_against_brute_force('squares.tt')
+
+
+if __name__ == '__main__':
+    unittest.main()